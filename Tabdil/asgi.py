@@ -2,6 +2,8 @@
 ASGI config for Tabdil project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Prometheus scrapes of ``/metrics/`` are answered by prometheus_client directly,
+without going through Django's URL resolver and middleware stack.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -9,8 +11,24 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Tabdil.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+application = django_application
+
+if settings.ENABLE_PROMETHEUS:
+    from prometheus_client import make_asgi_app
+
+    from Tabdil.metrics import METRICS_PATHS, get_metrics_registry
+
+    metrics_application = make_asgi_app(get_metrics_registry())
+
+    async def metrics_aware_application(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in METRICS_PATHS:
+            return await metrics_application(scope, receive, send)
+        return await django_application(scope, receive, send)
+
+    application = metrics_aware_application
@@ -0,0 +1,18 @@
+import os
+
+import prometheus_client
+from prometheus_client import multiprocess
+
+# Paths served by the Prometheus exporter instead of Django; also excluded from request logs and metrics
+METRICS_PATHS = frozenset(('/metrics', '/metrics/'))
+
+
+def get_metrics_registry():
+    """
+    Return the registry to export, aggregating worker processes when multiprocess mode is enabled.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ or 'prometheus_multiproc_dir' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
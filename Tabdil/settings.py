@@ -3,6 +3,8 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from logstash_async.constants import constants as logstash_constants
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-^=)@@6+$_ojqzs2l1$-3k&hj5jj-*e!o4!b1#ftv#3)helcmyp')
@@ -35,15 +37,16 @@ MIDDLEWARE = [
     'django_prometheus.middleware.PrometheusBeforeMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Session, CSRF, auth and message middlewares are skipped for JWT-only /api/ requests
+    'api.middleware.NonApiSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'api.middleware.NonApiCsrfViewMiddleware',
+    'api.middleware.NonApiAuthenticationMiddleware',
+    'api.middleware.NonApiMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
-    # Custom Prometheus metrics middleware
-    'api.prometheus_middleware.PrometheusMetricsMiddleware',
+    # Custom Prometheus metrics middleware (request, database and cache metrics of core.metrics)
+    'core.middleware.MetricsMiddleware',
 
     # API request/response logging middleware
     'api.middleware.RequestResponseLoggingMiddleware',
@@ -80,9 +83,13 @@ DATABASES = {
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
-        'HOST': 'pgbouncer',
-        'PORT': '6432',
-        'CONN_MAX_AGE': 0,
+        'HOST': os.getenv('DB_HOST', 'pgbouncer'),
+        'PORT': os.getenv('DB_PORT', '6432'),
+        # 0 closes the connection after each request. Only raise it for sync/threaded workers:
+        # under gevent every request runs in a new greenlet with its own connection, so kept
+        # connections are never reused and pile up on pgbouncer until garbage-collected
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -151,6 +158,13 @@ SESSION_CACHE_ALIAS = 'default'
 # Logstash Configuration
 LOGSTASH_HOST = os.environ.get('LOGSTASH_HOST', 'logstash')
 LOGSTASH_PORT = int(os.environ.get('LOGSTASH_PORT', 5000))
+ENVIRONMENT = os.environ.get('ENVIRONMENT', 'development')
+
+# Ship Logstash events in batches of up to 500, at least every 100 ms
+logstash_constants.QUEUE_CHECK_INTERVAL = 0.1
+logstash_constants.QUEUED_EVENTS_FLUSH_INTERVAL = 0.1
+logstash_constants.QUEUED_EVENTS_FLUSH_COUNT = 500
+logstash_constants.QUEUED_EVENTS_BATCH_SIZE = 500
 
 # Logging Configuration
 LOGGING = {
@@ -158,8 +172,7 @@ LOGGING = {
     'disable_existing_loggers': False,
     'formatters': {
         'json': {
-            '()': 'pythonjsonlogger.jsonlogger.JsonFormatter',
-            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+            '()': 'api.logging_handlers.OrjsonFormatter',
         },
         'verbose': {
             'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
@@ -176,10 +189,15 @@ LOGGING = {
             'extra_prefix': 'extra',
             'extra': {
                 'project': 'tabdil',
-                'environment': os.environ.get('ENVIRONMENT', 'development'),
+                'environment': ENVIRONMENT,
             },
         },
     },
+    'filters': {
+        'skip_untracked_paths': {
+            '()': 'api.logging_handlers.SkipUntrackedPathsFilter',
+        },
+    },
     'handlers': {
         'console': {
             'level': 'DEBUG',
@@ -193,11 +211,12 @@ LOGGING = {
         },
         'file': {
             'level': 'INFO',
-            'class': 'logging.handlers.RotatingFileHandler',
+            'class': 'api.logging_handlers.BufferedRotatingFileHandler',
             'filename': os.path.join(BASE_DIR, 'logs/tabdil.log'),
             'maxBytes': 1024 * 1024 * 10,  # 10 MB
             'backupCount': 10,
-            'formatter': 'verbose',
+            'buffer_size': 64 * 1024,  # 64 KB
+            'formatter': 'json',
         },
         'error_file': {
             'level': 'ERROR',
@@ -215,28 +234,65 @@ LOGGING = {
             'port': LOGSTASH_PORT,
             'version': 1,
             'message_type': 'django',
-            'database_path': os.path.join(BASE_DIR, 'logstash_db'),
+            # The SQLite event store is only kept for development; elsewhere events are buffered
+            # in memory and dropped after `event_ttl` seconds if Logstash is unreachable
+            'database_path': os.path.join(BASE_DIR, 'logstash_db') if ENVIRONMENT == 'development' else None,
+            'event_ttl': None if ENVIRONMENT == 'development' else 60,
             'formatter': 'logstash',
         },
+        # Access log lines arrive already serialized by the logging middleware, so no formatter
+        'access_file': {
+            'level': 'INFO',
+            'class': 'api.logging_handlers.BufferedRotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'logs/access.log'),
+            'maxBytes': 1024 * 1024 * 10,  # 10 MB
+            'backupCount': 10,
+            'buffer_size': 64 * 1024,  # 64 KB
+        },
+        # Queue handlers: loggers only enqueue records, the handlers above run on
+        # listener threads started in ApiConfig.ready()
+        'queue_app': {
+            '()': 'api.logging_handlers.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file', 'cfg://handlers.json',
+                         'cfg://handlers.logstash'],
+        },
+        'queue_django': {
+            '()': 'api.logging_handlers.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file', 'cfg://handlers.logstash'],
+        },
+        'queue_access': {
+            '()': 'api.logging_handlers.QueueListenerHandler',
+            'handlers': ['cfg://handlers.access_file', 'cfg://handlers.logstash'],
+        },
+        'queue_errors': {
+            '()': 'api.logging_handlers.QueueListenerHandler',
+            'handlers': ['cfg://handlers.error_file', 'cfg://handlers.logstash'],
+        },
     },
     'loggers': {
         'django': {
-            'handlers': ['console', 'file', 'logstash'],
+            'handlers': ['queue_django'],
             'level': 'INFO',
             'propagate': True,
         },
         'django.request': {
-            'handlers': ['error_file', 'logstash'],
+            'handlers': ['queue_errors'],
+            'filters': ['skip_untracked_paths'],
             'level': 'ERROR',
             'propagate': False,
         },
         'api': {
-            'handlers': ['console', 'file', 'json', 'logstash'],
+            'handlers': ['queue_app'],
             'level': 'DEBUG',
             'propagate': False,
         },
+        'api.access': {
+            'handlers': ['queue_access'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'core': {
-            'handlers': ['console', 'file', 'json', 'logstash'],
+            'handlers': ['queue_app'],
             'level': 'DEBUG',
             'propagate': False,
         },
@@ -251,6 +307,7 @@ AUDITLOG_INCLUDE_TRACKING_MODELS = [
     'core.Vendor',
     'core.PhoneNumber',
     'core.VendorTransaction',
+    'core.VendorTransactionRejection',
     'core.PhoneNumberTransaction',
     'auth.models.User'
 ]
@@ -280,8 +337,8 @@ PROMETHEUS_EXPORT_MIGRATIONS = False
 if ENABLE_PROMETHEUS and 'django_prometheus' not in INSTALLED_APPS:
     INSTALLED_APPS.insert(0, 'django_prometheus')
 
-    # Update database settings to use django-prometheus
-    DATABASES['default']['ENGINE'] = 'django_prometheus.db.backends.postgresql'
+    # Update database settings to use django-prometheus (without DEBUG query logging)
+    DATABASES['default']['ENGINE'] = 'core.db_backend'
 
     # Update cache settings to use django-prometheus
     CACHES = {
@@ -290,6 +347,8 @@ if ENABLE_PROMETHEUS and 'django_prometheus' not in INSTALLED_APPS:
             'LOCATION': os.environ.get('CACHE_URL', 'redis://127.0.0.1:6379/1'),
             'OPTIONS': {
                 'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                # redis-py parses replies with hiredis automatically when it is installed
+                'COMPRESSOR': 'django_redis.compressors.lz4.Lz4Compressor',
                 'SOCKET_CONNECT_TIMEOUT': 5,  # seconds
                 'SOCKET_TIMEOUT': 5,  # seconds
                 'IGNORE_EXCEPTIONS': True,  # Don't raise exceptions on Redis errors
@@ -8,5 +8,7 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         "HOST": "db",
         "PORT": "5432",
+        "CONN_MAX_AGE": DATABASES['default']['CONN_MAX_AGE'],
+        "CONN_HEALTH_CHECKS": True,
     }
 }
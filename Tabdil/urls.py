@@ -1,31 +1,21 @@
-from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include, re_path
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
-from rest_framework_simplejwt.views import (
-    TokenRefreshView,
-)
-
-from api.swagger import get_api_info
-from api.views import CachedTokenObtainPairView
 
-# Prometheus metrics
-if settings.ENABLE_PROMETHEUS:
-    from django_prometheus import exports
-    from django.views.decorators.http import require_GET
+from api.swagger import get_api_info, gzipped_schema_json_view
+from api.views import CachedTokenObtainPairView, VendorTokenRefreshView
 
-
-    @require_GET
-    def prometheus_metrics_view(request):
-        return exports.ExportToDjangoView(request)
+# The generated schema only changes on deploy, so it is served from the cache
+SCHEMA_CACHE_TIMEOUT = 300
+SCHEMA_CACHE_KWARGS = {'key_prefix': 'swagger'}
 
 schema_view = get_schema_view(
     get_api_info(),
     public=True,
     permission_classes=[permissions.AllowAny, ],
     patterns=[path('api/token/', CachedTokenObtainPairView.as_view(), name='token_obtain_pair'),
-              path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+              path('api/token/refresh/', VendorTokenRefreshView.as_view(), name='token_refresh'),
               path('api/', include('api.urls'))],
 )
 
@@ -36,12 +26,17 @@ urlpatterns = [
 
     # JWT Token Endpoints
     path('api/token/', CachedTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-
-    path('metrics/', prometheus_metrics_view, name='prometheus-metrics'),
+    path('api/token/refresh/', VendorTokenRefreshView.as_view(), name='token_refresh'),
 
     # Swagger documentation
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('swagger.json', gzipped_schema_json_view(schema_view, SCHEMA_CACHE_TIMEOUT), name='schema-json-gzip'),
+    re_path(r'^swagger(?P<format>\.yaml)$',
+            schema_view.without_ui(cache_timeout=SCHEMA_CACHE_TIMEOUT, cache_kwargs=SCHEMA_CACHE_KWARGS),
+            name='schema-json'),
+    path('swagger/',
+         schema_view.with_ui('swagger', cache_timeout=SCHEMA_CACHE_TIMEOUT, cache_kwargs=SCHEMA_CACHE_KWARGS),
+         name='schema-swagger-ui'),
+    path('redoc/',
+         schema_view.with_ui('redoc', cache_timeout=SCHEMA_CACHE_TIMEOUT, cache_kwargs=SCHEMA_CACHE_KWARGS),
+         name='schema-redoc'),
 ]
@@ -2,6 +2,8 @@
 WSGI config for Tabdil project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+Prometheus scrapes of ``/metrics/`` are answered by prometheus_client directly,
+without going through Django's URL resolver and middleware stack.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
@@ -9,8 +11,24 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Tabdil.settings')
 
-application = get_wsgi_application()
+django_application = get_wsgi_application()
+application = django_application
+
+if settings.ENABLE_PROMETHEUS:
+    from prometheus_client import make_wsgi_app
+
+    from Tabdil.metrics import METRICS_PATHS, get_metrics_registry
+
+    metrics_application = make_wsgi_app(get_metrics_registry())
+
+    def metrics_aware_application(environ, start_response):
+        if environ.get('PATH_INFO') in METRICS_PATHS:
+            return metrics_application(environ, start_response)
+        return django_application(environ, start_response)
+
+    application = metrics_aware_application
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Register signal receivers
+        from . import signals  # noqa: F401
+        from .logging_handlers import start_queue_listeners
+
+        # Start draining the logging queues configured in settings.LOGGING
+        start_queue_listeners()
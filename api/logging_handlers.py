@@ -0,0 +1,101 @@
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import orjson
+
+from .utils import is_untracked_path
+
+# Listeners created by QueueListenerHandler; started once from ApiConfig.ready()
+_listeners = []
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Logging handler that only enqueues records.
+    Formatting and I/O for the wrapped `handlers` run on a QueueListener thread,
+    so request threads never block on file writes or the Logstash socket.
+    """
+
+    def __init__(self, handlers, respect_handler_level=True):
+        super().__init__(queue.Queue(-1))
+        # dictConfig passes a ConvertingList; indexing resolves the cfg:// references to handlers
+        handlers = [handlers[i] for i in range(len(handlers))]
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=respect_handler_level)
+        _listeners.append(self.listener)
+
+
+def start_queue_listeners():
+    """
+    Start the listener thread of every configured QueueListenerHandler.
+    """
+    while _listeners:
+        listener = _listeners.pop()
+        listener.start()
+        atexit.register(listener.stop)
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that writes through a `buffer_size` byte buffer instead of
+    flushing after every record. The file size is tracked in-process because
+    tell()/seek() on the stream would flush the buffer on every check.
+    """
+
+    def __init__(self, *args, buffer_size=64 * 1024, **kwargs):
+        self.buffer_size = buffer_size
+        self.bytes_written = 0
+        super().__init__(*args, **kwargs)
+
+    def _open(self):
+        stream = open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                      encoding=self.encoding, errors=self.errors)
+        self.bytes_written = os.path.getsize(self.baseFilename)
+        return stream
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.bytes_written + len(msg) > self.maxBytes:
+                self.doRollover()
+            self.stream.write(msg)
+            self.bytes_written += len(msg)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class OrjsonFormatter(logging.Formatter):
+    """
+    JSON formatter encoding each record once with orjson.
+    A dict passed as `extra={'payload': {...}}` is merged into the top-level object.
+    """
+
+    def format(self, record):
+        data = {
+            'ts': record.created,
+            'lvl': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        payload = getattr(record, 'payload', None)
+        if payload:
+            data.update(payload)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return orjson.dumps(data, default=str).decode()
+
+
+class SkipUntrackedPathsFilter(logging.Filter):
+    """
+    Drop records about requests to untracked paths such as the Prometheus scrape endpoint.
+    """
+
+    def filter(self, record):
+        request = getattr(record, 'request', None)
+        return request is None or not is_untracked_path(request.path)
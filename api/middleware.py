@@ -1,9 +1,53 @@
-import json
 import logging
+import secrets
 import time
-from uuid import uuid4
 
-logger = logging.getLogger('api')
+import orjson
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+from .utils import is_untracked_path
+
+# Access log lines are serialized here; the api.access handlers write them without reformatting
+logger = logging.getLogger('api.access')
+
+# Requests under this prefix are authenticated by JWT and never use sessions
+API_PATH_PREFIX = '/api/'
+
+# Request/response bodies larger than this (bytes) are not copied into the log line
+MAX_LOGGED_BODY_SIZE = 4096
+
+
+class SkipApiPathsMixin:
+    """
+    Mixin that bypasses a middleware for API requests.
+    The API is JWT-only, so session, auth, message and CSRF handling are only
+    needed for the admin and other browser-facing paths.
+    """
+    async_capable = False
+
+    def __call__(self, request):
+        if request.path_info.startswith(API_PATH_PREFIX):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class NonApiSessionMiddleware(SkipApiPathsMixin, SessionMiddleware):
+    pass
+
+
+class NonApiCsrfViewMiddleware(SkipApiPathsMixin, CsrfViewMiddleware):
+    pass
+
+
+class NonApiAuthenticationMiddleware(SkipApiPathsMixin, AuthenticationMiddleware):
+    pass
+
+
+class NonApiMessageMiddleware(SkipApiPathsMixin, MessageMiddleware):
+    pass
 
 
 class RequestResponseLoggingMiddleware:
@@ -14,26 +58,37 @@ class RequestResponseLoggingMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
+        # Bound once here instead of being looked up on every request
+        self._log_request = self.log_request
+        self._log_response = self.log_response
+        self._info = logger.info
+        self._time = time.perf_counter
 
     def __call__(self, request):
+        get_response = self.get_response
+
+        # Don't log Prometheus scrapes and static files
+        if is_untracked_path(request.path):
+            return get_response(request)
+
         # Generate a unique request ID
-        request_id = str(uuid4())
+        request_id = secrets.token_hex(8)
         request.id = request_id
 
         # Log the request
-        self.log_request(request)
+        self._log_request(request)
 
         # Start timing
-        start_time = time.time()
+        start_time = self._time()
 
         # Process the request
-        response = self.get_response(request)
+        response = get_response(request)
 
         # Calculate request processing time
-        duration = time.time() - start_time
+        duration = self._time() - start_time
 
         # Log the response
-        self.log_response(request, response, duration)
+        self._log_response(request, response, duration)
 
         return response
 
@@ -42,8 +97,9 @@ class RequestResponseLoggingMiddleware:
         Log details of the incoming request.
         """
         data = {
+            'ts': time.time(),
             'request_id': getattr(request, 'id', None),
-            'user': str(request.user) if request.user.is_authenticated else 'Anonymous',
+            'user': self.get_username(request),
             'method': request.method,
             'path': request.path,
             'query_params': dict(request.GET.items()),
@@ -51,22 +107,24 @@ class RequestResponseLoggingMiddleware:
             'event': 'request',
         }
 
-        # Try to parse request body if it's JSON
-        if request.content_type == 'application/json' and request.body:
-            try:
-                data['body'] = json.loads(request.body)
-            except json.JSONDecodeError:
-                data['body'] = 'Invalid JSON body'
+        # Log the raw JSON body; Content-Length is checked first so oversized bodies are never read here
+        if request.content_type == 'application/json':
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+            if content_length > MAX_LOGGED_BODY_SIZE:
+                data['body'] = f'<{content_length} bytes>'
+            elif content_length:
+                data['body'] = self.get_loggable_body(request.body)
 
-        logger.info(f'API Request: {json.dumps(data)}')
+        self._info(orjson.dumps(data).decode())
 
     def log_response(self, request, response, duration):
         """
         Log details of the response.
         """
         data = {
+            'ts': time.time(),
             'request_id': getattr(request, 'id', None),
-            'user': str(request.user) if request.user.is_authenticated else 'Anonymous',
+            'user': self.get_username(request),
             'method': request.method,
             'path': request.path,
             'status_code': response.status_code,
@@ -74,14 +132,28 @@ class RequestResponseLoggingMiddleware:
             'event': 'response',
         }
 
-        # Try to parse response content if it's JSON
+        # Log the raw JSON content without parsing it
         if hasattr(response, 'content') and response.get('Content-Type', '') == 'application/json':
-            try:
-                data['response_body'] = json.loads(response.content)
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                pass
+            data['response_body'] = self.get_loggable_body(response.content)
 
-        logger.info(f'API Response: {json.dumps(data)}')
+        self._info(orjson.dumps(data).decode())
+
+    def get_username(self, request):
+        """
+        Get the username of the request user.
+        API requests have no user until DRF authenticates them in the view.
+        """
+        user = getattr(request, 'user', None)
+        return str(user) if user is not None and user.is_authenticated else 'Anonymous'
+
+    def get_loggable_body(self, body):
+        """
+        Return a raw body as text for logging, or a size placeholder when it is too large.
+        The body is logged as-is instead of being parsed and re-serialized.
+        """
+        if len(body) > MAX_LOGGED_BODY_SIZE:
+            return f'<{len(body)} bytes>'
+        return body.decode('utf-8', errors='replace')
 
     def get_client_ip(self, request):
         """
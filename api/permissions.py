@@ -1,10 +1,75 @@
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from rest_framework import permissions
+from rest_framework.exceptions import PermissionDenied
+
 from core.models import Vendor
 
+# How long (seconds) the user -> vendor mapping is trusted before re-checking the database
+VENDOR_PERMISSION_CACHE_TIMEOUT = 300
+
+
+def vendor_permission_cache_key(user_id):
+    return f"perm:vendor_id:{user_id}"
+
+
+def get_vendor_id(request):
+    """
+    Return the id of the vendor owned by the request user, or None.
+    The id is read from the JWT claims when present, otherwise it is cached
+    per user. Either way it is memoized on the request, so writes can use
+    `vendor_id=` without fetching the Vendor row.
+    """
+    if not hasattr(request, '_cached_vendor_id'):
+        token = request.auth
+        if token is not None and 'is_vendor' in token:
+            vendor_id = token['vendor_id'] if token['is_vendor'] else None
+        else:
+            # Stored as 0 for non-vendors so a cached "no vendor" is not mistaken for a cache miss (None)
+            vendor_id = cache.get_or_set(
+                vendor_permission_cache_key(request.user.id),
+                lambda: Vendor.objects.filter(user=request.user).values_list('id', flat=True).first() or 0,
+                timeout=VENDOR_PERMISSION_CACHE_TIMEOUT,
+            ) or None
+        request._cached_vendor_id = vendor_id
+    return request._cached_vendor_id
+
+
+def stale_vendor_denied(request):
+    """
+    Return the PermissionDenied for a request whose vendor id (JWT claim or cached mapping)
+    points at a Vendor that was deleted while its user was kept, and drop the cached mapping.
+    """
+    cache.delete(vendor_permission_cache_key(request.user.id))
+    return PermissionDenied("Vendor account no longer exists.")
+
+
+@contextmanager
+def vendor_atomic(request):
+    """
+    transaction.atomic() for writes referencing get_vendor_id(request), yielding the vendor id.
+    The vendor FK is checked at commit, so a deleted vendor shows up as an IntegrityError here;
+    it is turned into a 403 instead of a 500.
+    """
+    vendor_id = get_vendor_id(request)
+    try:
+        with transaction.atomic():
+            yield vendor_id
+    except IntegrityError:
+        if Vendor.objects.filter(pk=vendor_id).exists():
+            raise
+        raise stale_vendor_denied(request)
+
 
 class IsVendorUser(permissions.BasePermission):
     """
     Custom permission to only allow users who have an associated vendor account.
+    Uses the `is_vendor` JWT claim; tokens without it fall back to a per-user cached
+    lookup that is invalidated by the Vendor save/delete signals.
+    The claim outlives a vendor deleted in the admin, so views that use the vendor id
+    answer such requests with stale_vendor_denied().
     """
 
     def has_permission(self, request, view):
@@ -13,4 +78,4 @@ class IsVendorUser(permissions.BasePermission):
             return False
 
         # Check if the authenticated user has an associated vendor
-        return Vendor.objects.filter(user=request.user).exists()
+        return get_vendor_id(request) is not None
@@ -1,61 +1,55 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
 import constants
 from core.models import Vendor, VendorTransaction, PhoneNumber, PhoneNumberTransaction
+from .permissions import get_vendor_id
 
 
 # Serializers
 
 # -- User --
-class UserSerializer(serializers.ModelSerializer):
+class _BaseUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'password']
+        fields = ['id', 'username', 'email']
+        read_only_fields = ('id',)
         extra_kwargs = {
-            'id': {'read_only': True},
             'username': {'default': 'admin'},
             'email': {'default': 'admin@localhost'},
-            'password': {'default': 'admin', 'write_only': True},
         }
 
 
-class UserUpdateSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = User
-        fields = ['id', 'username', 'email']
+class UserSerializer(_BaseUserSerializer):
+    class Meta(_BaseUserSerializer.Meta):
+        fields = _BaseUserSerializer.Meta.fields + ['password']
         extra_kwargs = {
-            'id': {'read_only': True},
-            'username': {'default': 'admin'},
-            'email': {'default': 'admin@localhost'},
+            **_BaseUserSerializer.Meta.extra_kwargs,
+            'password': {'default': 'admin', 'write_only': True},
         }
 
 
-# -- Vendor User --
-class VendorSerializer(serializers.ModelSerializer):
-    user = UserSerializer()
+class UserUpdateSerializer(_BaseUserSerializer):
+    pass
+
 
+# -- Vendor User --
+class _BaseVendorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vendor
         fields = ['id', 'user', 'balance', 'total_sell']
-        extra_kwargs = {
-            'id': {'read_only': True},
-            'balance': {'read_only': True},
-            'total_sell': {'read_only': True},
-        }
+        read_only_fields = ('id', 'balance', 'total_sell')
 
 
-class VendorUpdateSerializer(serializers.ModelSerializer):
-    user = UserUpdateSerializer()
+class VendorSerializer(_BaseVendorSerializer):
+    user = UserSerializer()
 
-    class Meta:
-        model = Vendor
-        fields = ['id', 'user', 'balance', 'total_sell']
-        extra_kwargs = {
-            'id': {'read_only': True},
-            'balance': {'read_only': True},
-            'total_sell': {'read_only': True},
-        }
+
+class VendorUpdateSerializer(_BaseVendorSerializer):
+    user = UserUpdateSerializer()
 
 
 # -- Phone Number --
@@ -63,11 +57,9 @@ class PhoneNumberSerializer(serializers.ModelSerializer):
     class Meta:
         model = PhoneNumber
         fields = ['id', 'phone_number', 'balance', 'vendor']
+        read_only_fields = ('id', 'balance', 'vendor')
         extra_kwargs = {
-            'id': {'read_only': True},
             'phone_number': {'default': '09123456789'},
-            'balance': {'read_only': True},
-            'vendor': {'read_only': True},
         }
 
 
@@ -76,12 +68,9 @@ class VendorTransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = VendorTransaction
         fields = ['id', 'amount', 'state', 'vendor', 'reject_reason']
+        read_only_fields = ('id', 'state', 'vendor', 'reject_reason')
         extra_kwargs = {
-            'id': {'read_only': True},
             'amount': {'default': 1000},
-            'state': {'read_only': True},
-            'vendor': {'read_only': True},
-            'reject_reason': {'read_only': True},
         }
 
     def validate_amount(self, value):
@@ -91,12 +80,14 @@ class VendorTransactionSerializer(serializers.ModelSerializer):
 
 
 class VendorTransactionUpdateSerializer(serializers.ModelSerializer):
+    # Stored on VendorTransactionRejection; read back through the model's reject_reason property
+    reject_reason = serializers.CharField(default='', required=False, allow_blank=True, allow_null=True)
+
     class Meta:
         model = VendorTransaction
         fields = ['state', 'reject_reason']
         extra_kwargs = {
             'state': {'default': constants.APPROVED},
-            'reject_reason': {'default': '', 'required': False},
         }
 
 
@@ -106,27 +97,63 @@ class PhoneNumberTransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = PhoneNumberTransaction
         fields = ['id', 'amount', 'state', 'vendor', 'phone_number']
+        read_only_fields = ('id', 'state', 'vendor')
         extra_kwargs = {
-            'id': {'read_only': True},
             'amount': {'default': 1000},
-            'state': {'read_only': True},
-            'vendor': {'read_only': True},
         }
 
     def validate(self, attrs):
         request = self.context['request']
-        vendor = Vendor.objects.filter(user=request.user).first()
 
         phone_number = attrs['phone_number']
-        if phone_number.vendor != vendor:
+        if phone_number.vendor_id != get_vendor_id(request):
             raise serializers.ValidationError("Phone number is not owned by this vendor.")
 
-        amount = attrs['amount']
-        if vendor.balance < amount:
-            raise serializers.ValidationError("Insufficient balance.")
-
-        if amount <= 0:
+        if attrs['amount'] <= 0:
             raise serializers.ValidationError("Amount must be greater than 0.")
 
-        attrs['vendor'] = vendor
+        # The balance is checked by the conditional UPDATE in the view
         return attrs
+
+
+# -- JWT --
+def set_vendor_claims(token, user_id):
+    """
+    Set the `is_vendor` and `vendor_id` claims of `token` from the database.
+    """
+    vendor_id = Vendor.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+    token['is_vendor'] = vendor_id is not None
+    token['vendor_id'] = vendor_id
+
+
+class VendorTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Adds `is_vendor` and `vendor_id` claims so IsVendorUser can authorize from the token alone.
+    The claims go stale if the vendor is deleted while its user is kept (e.g. in the admin):
+    access tokens carry them until they expire, and refreshing re-reads them
+    (see VendorTokenRefreshSerializer). Views answer stale claims with a 403
+    (see api.permissions.stale_vendor_denied).
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        set_vendor_claims(token, user.pk)
+        return token
+
+
+class VendorRefreshToken(RefreshToken):
+    """
+    Refresh token whose access tokens get freshly read vendor claims instead of the ones
+    copied at login, which would otherwise live as long as the refresh token.
+    """
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        set_vendor_claims(access, self.payload[jwt_settings.USER_ID_CLAIM])
+        return access
+
+
+class VendorTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = VendorRefreshToken
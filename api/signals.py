@@ -0,0 +1,15 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Vendor
+from .permissions import vendor_permission_cache_key
+
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+def invalidate_vendor_permission_cache(sender, instance, **kwargs):
+    """
+    Drop the cached IsVendorUser result for the vendor's user.
+    """
+    cache.delete(vendor_permission_cache_key(instance.user_id))
@@ -1,7 +1,21 @@
+import gzip
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
 from drf_yasg import openapi
 from drf_yasg.inspectors import SwaggerAutoSchema
 
 
+@lru_cache(maxsize=256)
+def _tag_for(operation_key):
+    """
+    Turn an operation key such as `vendor-transactions` into the tag `Vendor Transactions`.
+    """
+    return operation_key.replace('-', ' ').title()
+
+
 class CustomSwaggerAutoSchema(SwaggerAutoSchema):
     """
     Custom Swagger schema generator that adds more descriptive information
@@ -14,7 +28,7 @@ class CustomSwaggerAutoSchema(SwaggerAutoSchema):
             # Use the second element of the operation keys as the tag
             # This is typically the model name in DRF ViewSets
             if operation_keys[0] == 'api':
-                return [operation_keys[1].replace('-', ' ').title()]
+                return [_tag_for(operation_keys[1])]
         return tags
 
 
@@ -26,3 +40,38 @@ def get_api_info():
         title="Tabdil Task API",
         default_version='v1',
     )
+
+
+SCHEMA_JSON_GZIP_CACHE_KEY_PREFIX = 'swagger:json:gz'
+
+
+def gzipped_schema_json_view(schema_view, cache_timeout):
+    """
+    Returns a view serving the schema as JSON, stored gzipped in the cache.
+    The schema is rendered on the first request after the cache entry expires,
+    and served compressed to clients that accept gzip.
+    The rendered schema embeds the request's host and scheme, so there is one entry per
+    scheme and host; get_host() only accepts ALLOWED_HOSTS.
+    """
+    render_schema = schema_view.without_ui(cache_timeout=0)
+
+    def view(request):
+        cache_key = f"{SCHEMA_JSON_GZIP_CACHE_KEY_PREFIX}:{request.scheme}:{request.get_host()}"
+        blob = cache.get(cache_key)
+        if blob is None:
+            schema_response = render_schema(request, format='.json')
+            schema_response.render()
+            if schema_response.status_code != 200:
+                return schema_response
+            blob = gzip.compress(schema_response.content, compresslevel=6)
+            cache.set(cache_key, blob, cache_timeout)
+
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(blob, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(blob), content_type='application/json')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    return view
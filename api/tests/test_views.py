@@ -1,25 +1,29 @@
+import gzip
+import json
+
+from auditlog.models import LogEntry
 from django.contrib.auth.models import User
 from django.test import TransactionTestCase
+from prometheus_client import REGISTRY
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
 import constants
 from core.models import Vendor, PhoneNumber, VendorTransaction, PhoneNumberTransaction
 
 
 class BaseAPITestCase(APITestCase):
-    def create_admin(self):
-        return User.objects.create_user(username='admin', password='adminpass', is_staff=True)
-
-    def create_vendor_user(self):
-        user = User.objects.create_user(username='vendor', password='vendorpass')
-        vendor = Vendor.objects.create(user=user, balance=1000, total_sell=0)
-        return user, vendor
+    @classmethod
+    def setUpTestData(cls):
+        # Created once per class; each test runs in a savepoint that is rolled back
+        cls.admin = User.objects.create_user(username='admin', password='adminpass', is_staff=True)
+        cls.vendor_user = User.objects.create_user(username='vendor', password='vendorpass')
+        cls.vendor = Vendor.objects.create(user=cls.vendor_user, balance=1000, total_sell=0)
 
 
 class AdminUserViewSetTest(BaseAPITestCase):
     def test_create_admin_user(self):
-        admin = self.create_admin()
-        self.client.force_authenticate(admin)
+        self.client.force_authenticate(self.admin)
         data = {"username": "newadmin", "password": "pass123"}
         response = self.client.post("/api/admin-users/", data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -28,7 +32,6 @@ class AdminUserViewSetTest(BaseAPITestCase):
 
 class VendorViewSetTest(BaseAPITestCase):
     def setUp(self):
-        self.admin = self.create_admin()
         self.client.force_authenticate(self.admin)
 
     def test_create_vendor(self):
@@ -39,35 +42,113 @@ class VendorViewSetTest(BaseAPITestCase):
         self.assertTrue(Vendor.objects.filter(user__username="vendorA").exists())
 
     def test_update_vendor_and_user(self):
-        user, vendor = self.create_vendor_user()
         data = {"user": {"username": "updatedvendor"}}
-        response = self.client.patch(f"/api/vendors/{vendor.id}/", data, format='json')
+        response = self.client.patch(f"/api/vendors/{self.vendor.id}/", data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        user.refresh_from_db()
-        self.assertEqual(user.username, "updatedvendor")
+        self.vendor_user.refresh_from_db()
+        self.assertEqual(self.vendor_user.username, "updatedvendor")
 
     def test_delete_vendor_also_deletes_user(self):
-        user, vendor = self.create_vendor_user()
-        response = self.client.delete(f"/api/vendors/{vendor.id}/")
+        response = self.client.delete(f"/api/vendors/{self.vendor.id}/")
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertFalse(User.objects.filter(id=user.id).exists())
+        self.assertFalse(User.objects.filter(id=self.vendor_user.id).exists())
 
     def test_vendor_me_endpoint(self):
-        user, vendor = self.create_vendor_user()
-        self.client.force_authenticate(user)
+        self.client.force_authenticate(self.vendor_user)
         response = self.client.get("/api/vendors/me/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["id"], vendor.id)
+        self.assertEqual(response.data["id"], self.vendor.id)
 
 
 class PhoneNumberViewSetTest(BaseAPITestCase):
     def test_vendor_can_create_phone_number(self):
-        user, vendor = self.create_vendor_user()
-        self.client.force_authenticate(user)
+        self.client.force_authenticate(self.vendor_user)
         data = {"phone_number": "1234567890", "balance": 0}  # no vendor here
         response = self.client.post("/api/phone-numbers/", data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertTrue(PhoneNumber.objects.filter(phone_number="1234567890", vendor=vendor).exists())
+        self.assertTrue(PhoneNumber.objects.filter(phone_number="1234567890", vendor=self.vendor).exists())
+
+
+class TokenObtainViewTest(BaseAPITestCase):
+    def test_vendor_token_carries_vendor_claims(self):
+        user = User.objects.create_user(username='tokenvendor', password='vendorpass')
+        vendor = Vendor.objects.create(user=user, balance=1000, total_sell=0)
+        response = self.client.post("/api/token/", {"username": "tokenvendor", "password": "vendorpass"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = AccessToken(response.data["access"])
+        self.assertTrue(token["is_vendor"])
+        self.assertEqual(token["vendor_id"], vendor.id)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        response = self.client.get("/api/vendors/me/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], vendor.id)
+
+    def test_refresh_rereads_vendor_claims(self):
+        response = self.client.post("/api/token/", {"username": "vendor", "password": "vendorpass"})
+        self.assertTrue(AccessToken(response.data["access"])["is_vendor"])
+        Vendor.objects.filter(pk=self.vendor.pk).delete()
+
+        response = self.client.post("/api/token/refresh/", {"refresh": response.data["refresh"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = AccessToken(response.data["access"])
+        self.assertFalse(token["is_vendor"])
+        self.assertIsNone(token["vendor_id"])
+
+    def test_wrong_password_is_rejected_after_login(self):
+        User.objects.create_user(username='tokenuser', password='rightpass')
+        response = self.client.post("/api/token/", {"username": "tokenuser", "password": "rightpass"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post("/api/token/", {"username": "tokenuser", "password": "wrongpass"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_admin_token_is_not_vendor(self):
+        User.objects.create_user(username='tokenadmin', password='adminpass', is_staff=True)
+        response = self.client.post("/api/token/", {"username": "tokenadmin", "password": "adminpass"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = AccessToken(response.data["access"])
+        self.assertFalse(token["is_vendor"])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        response = self.client.get("/api/vendors/me/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MetricsMiddlewareTest(BaseAPITestCase):
+    def test_request_updates_exported_samples(self):
+        request_labels = {'method': 'GET', 'endpoint': 'vendors-me', 'status': '200'}
+        requests_before = REGISTRY.get_sample_value('api_requests_total', request_labels) or 0
+        queries_before = REGISTRY.get_sample_value('db_queries_per_request_count', {'endpoint': 'vendors-me'}) or 0
+
+        self.client.force_authenticate(self.vendor_user)
+        response = self.client.get("/api/vendors/me/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(REGISTRY.get_sample_value('api_requests_total', request_labels), requests_before + 1)
+        self.assertEqual(REGISTRY.get_sample_value('db_queries_per_request_count', {'endpoint': 'vendors-me'}),
+                         queries_before + 1)
+
+    def test_scrape_does_not_query_vendor_balances(self):
+        # The balance snapshot is refreshed in the background, never by the scrape itself
+        with self.assertNumQueries(0):
+            REGISTRY.get_sample_value('vendor_balance_dist_gsum')
+
+
+class SchemaJsonViewTest(BaseAPITestCase):
+    def test_schema_json_is_gzipped_when_accepted(self):
+        response = self.client.get("/swagger.json", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("paths", json.loads(gzip.decompress(response.content)))
+
+        response = self.client.get("/swagger.json")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("paths", json.loads(response.content))
+
+    def test_schema_json_is_cached_per_host(self):
+        self.client.get("/swagger.json", HTTP_HOST="api.example.com")
+        response = self.client.get("/swagger.json", HTTP_HOST="docs.example.com")
+        self.assertEqual(json.loads(response.content)["host"], "docs.example.com")
 
 
 class VendorTransactionViewSetTest(TransactionTestCase):
@@ -90,9 +171,22 @@ class VendorTransactionViewSetTest(TransactionTestCase):
         data = {"amount": 500}
         response = self.client.post("/api/vendor-transactions/", data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['reject_reason'], '')
         tx = VendorTransaction.objects.get(vendor=vendor)
         self.assertEqual(tx.state, constants.PENDING)
 
+    def test_token_of_deleted_vendor_is_forbidden(self):
+        user, vendor = self.create_vendor_user()
+        response = self.client.post("/api/token/", {"username": "vendor", "password": "vendorpass"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        # Deleted in the admin: the user and its token's vendor claims survive
+        vendor.delete()
+        response = self.client.get("/api/vendors/me/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post("/api/vendor-transactions/", {"amount": 500}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(VendorTransaction.objects.exists())
+
     def test_admin_can_change_state_to_approved_and_balance_updates(self):
         user, vendor = self.create_vendor_user()
         tx = VendorTransaction.objects.create(vendor=vendor, amount=200, state=constants.PENDING)
@@ -101,8 +195,31 @@ class VendorTransactionViewSetTest(TransactionTestCase):
         data = {"state": constants.APPROVED}
         response = self.client.post(f"/api/vendor-transactions/{tx.id}/change_state/", data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['vendor']['balance'], 1200)
+        self.assertEqual(response.data['vendor']['user']['username'], 'vendor')
         vendor.refresh_from_db()
         self.assertEqual(vendor.balance, 1200)
+        entry = LogEntry.objects.get_for_object(tx).get(action=LogEntry.Action.UPDATE)
+        self.assertEqual(entry.changes_dict, {'state': [constants.PENDING, constants.APPROVED]})
+
+        # Already approved, then a transaction that doesn't exist
+        response = self.client.post(f"/api/vendor-transactions/{tx.id}/change_state/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"/api/vendor-transactions/{tx.id + 1}/change_state/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_admin_reject_stores_reason_and_keeps_balance(self):
+        user, vendor = self.create_vendor_user()
+        tx = VendorTransaction.objects.create(vendor=vendor, amount=200, state=constants.PENDING)
+        self.client.force_authenticate(self.create_admin())
+        data = {"state": constants.REJECTED, "reject_reason": "Receipt missing"}
+        response = self.client.post(f"/api/vendor-transactions/{tx.id}/change_state/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['reject_reason'], "Receipt missing")
+        tx.refresh_from_db()
+        self.assertEqual(tx.reject_reason, "Receipt missing")
+        vendor.refresh_from_db()
+        self.assertEqual(vendor.balance, 1000)
 
     def test_concurrent_approvals_only_one_updates_balance(self):
         user, vendor = self.create_vendor_user()
@@ -160,50 +277,96 @@ class PhoneNumberTransactionViewSetTest(TransactionTestCase):
         self.assertEqual(vendor.balance, 900)
         self.assertEqual(phone.balance, 100)
 
+    def test_list_is_not_modified_until_a_new_transaction(self):
+        user, vendor = self.create_vendor_user()
+        phone = PhoneNumber.objects.create(vendor=vendor, phone_number="55557", balance=0)
+        self.client.force_authenticate(user=user)
+        response = self.client.get("/api/phone-transactions/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        response = self.client.get("/api/phone-transactions/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post("/api/phone-transactions/", {"phone_number": phone.id, "amount": 10}, format='json')
+        response = self.client.get("/api/phone-transactions/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_transfer_above_balance_is_rejected(self):
+        user, vendor = self.create_vendor_user()
+        phone = PhoneNumber.objects.create(vendor=vendor, phone_number="55556", balance=0)
+        self.client.force_authenticate(user=user)
+        data = {"phone_number": phone.id, "amount": 1001}
+        response = self.client.post("/api/phone-transactions/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("non_field_errors", response.data)
+        vendor.refresh_from_db()
+        phone.refresh_from_db()
+        self.assertEqual(vendor.balance, 1000)
+        self.assertEqual(vendor.total_sell, 0)
+        self.assertEqual(phone.balance, 0)
+        self.assertFalse(PhoneNumberTransaction.objects.exists())
+
 
 from django.db import connection
 from django.db.models import F
 from rest_framework import status
-from rest_framework.test import APIClient
-from django.test import TransactionTestCase
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from django.test import TestCase, TransactionTestCase
 import threading
 
+from api.views import PhoneNumberTransactionViewSet
+
+
+class SalesFixtureMixin:
+    """
+    Two vendors with a zero balance, each owning one phone number.
+    """
 
-class VendorMassiveTransactionTest(TransactionTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor_users = User.objects.bulk_create([User(username=f'vendor{i}') for i in range(2)])
+        cls.vendors = Vendor.objects.bulk_create(
+            [Vendor(user=user, balance=0, total_sell=0) for user in cls.vendor_users]
+        )
+        cls.phones = PhoneNumber.objects.bulk_create([
+            PhoneNumber(vendor=vendor, phone_number=f'55555{i}', balance=0)
+            for i, vendor in enumerate(cls.vendors)
+        ])
+
+
+class VendorConcurrencySmokeTest(SalesFixtureMixin, TransactionTestCase):
+    """
+    A few concurrent sales from two threads; totals at volume are covered by VendorMassiveBulkTest.
+    """
     reset_sequences = True
+    sales_per_vendor = 10
 
     def setUp(self):
-        self.client = APIClient()
-        self.vendor_users = []
-        self.vendors = []
-        self.phones = []
-
-        for i in range(2):
-            user = User.objects.create_user(username=f'vendor{i}', password='pass')
-            vendor = Vendor.objects.create(user=user, balance=0, total_sell=0)
-            phone = PhoneNumber.objects.create(vendor=vendor, phone_number=f'55555{i}', balance=0)
-            self.vendor_users.append(user)
-            self.vendors.append(vendor)
-            self.phones.append(phone)
+        self.view = PhoneNumberTransactionViewSet.as_view({'post': 'create'})
+        # TransactionTestCase never calls setUpTestData and flushes the tables after each test
+        self.setUpTestData()
 
-    def test_massive_topup_and_sales(self):
+    def test_concurrent_topup_and_sales(self):
         topup_amount = 1000
         sales_amount = 1
 
-        # Perform 10 top-ups for each vendor
-        for idx, vendor in enumerate(self.vendors):
-            for _ in range(10):
-                Vendor.objects.filter(pk=vendor.pk).update(balance=F('balance') + topup_amount)
-            vendor.refresh_from_db()
+        # 10 top-ups for each vendor, as a single UPDATE
+        Vendor.objects.filter(pk__in=[vendor.pk for vendor in self.vendors]).update(
+            balance=F('balance') + 10 * topup_amount
+        )
 
         # Function to perform sales (transfer balance to phone)
         def perform_sales(user, phone, results, index):
             try:
-                client = APIClient()
-                client.force_authenticate(user)
-                for _ in range(500):  # 500 sales for each vendor
+                # The view is called directly; the HTTP stack is not what this test exercises
+                factory = APIRequestFactory()
+                for _ in range(self.sales_per_vendor):
                     data = {"phone_number": phone.id, "amount": sales_amount}
-                    response = client.post("/api/phone-transactions/", data, format='json')
+                    request = factory.post("/api/phone-transactions/", data, format='json')
+                    force_authenticate(request, user=user)
+                    response = self.view(request)
                     results[index].append(response.status_code)
             finally:
                 connection.close()  # Ensure DB connection closes in each thread
@@ -225,18 +388,47 @@ class VendorMassiveTransactionTest(TransactionTestCase):
             phone.refresh_from_db()
 
         # Each vendor topup = 10 * 1000 = 10000
-        # Each vendor made 500 sales * 1 = 500 deducted
-        self.assertEqual(self.vendors[0].balance, 10000 - 500)
-        self.assertEqual(self.vendors[1].balance, 10000 - 500)
+        self.assertEqual(self.vendors[0].balance, 10000 - self.sales_per_vendor)
+        self.assertEqual(self.vendors[1].balance, 10000 - self.sales_per_vendor)
 
-        # Each phone receives 500 units
-        self.assertEqual(self.phones[0].balance, 500)
-        self.assertEqual(self.phones[1].balance, 500)
+        self.assertEqual(self.phones[0].balance, self.sales_per_vendor)
+        self.assertEqual(self.phones[1].balance, self.sales_per_vendor)
 
         # Verify total transactions
         total_transactions = PhoneNumberTransaction.objects.count()
-        self.assertEqual(total_transactions, 1000)
+        self.assertEqual(total_transactions, 2 * self.sales_per_vendor)
 
         # Ensure all requests succeeded
         for res_list in results:
             self.assertTrue(all(status == 201 for status in res_list))
+
+
+class VendorMassiveBulkTest(SalesFixtureMixin, TestCase):
+    """
+    500 sales per vendor driven in-process through the viewset, without threads or the test client.
+    """
+    sales_per_vendor = 500
+
+    def test_massive_topup_and_sales(self):
+        # 10 top-ups of 1000 for each vendor, as a single UPDATE
+        Vendor.objects.update(balance=F('balance') + 10 * 1000)
+
+        factory = APIRequestFactory()
+        view = PhoneNumberTransactionViewSet.as_view({'post': 'create'})
+        for user, phone in zip(self.vendor_users, self.phones):
+            for _ in range(self.sales_per_vendor):
+                request = factory.post("/api/phone-transactions/", {"phone_number": phone.id, "amount": 1},
+                                       format='json')
+                force_authenticate(request, user=user)
+                response = view(request)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        for vendor in self.vendors:
+            vendor.refresh_from_db()
+            self.assertEqual(vendor.balance, 10000 - self.sales_per_vendor)
+            self.assertEqual(vendor.total_sell, self.sales_per_vendor)
+        for phone in self.phones:
+            phone.refresh_from_db()
+            self.assertEqual(phone.balance, self.sales_per_vendor)
+
+        self.assertEqual(PhoneNumberTransaction.objects.count(), 2 * self.sales_per_vendor)
@@ -0,0 +1,12 @@
+from Tabdil.metrics import METRICS_PATHS
+
+# Paths excluded from request logging and metrics: the Prometheus scrape endpoint and static files
+UNTRACKED_PATHS = METRICS_PATHS
+UNTRACKED_PATH_PREFIXES = ('/static/',)
+
+
+def is_untracked_path(path):
+    """
+    Return True if requests to `path` should not be logged or measured.
+    """
+    return path in UNTRACKED_PATHS or path.startswith(UNTRACKED_PATH_PREFIXES)
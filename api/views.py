@@ -1,24 +1,74 @@
+import hashlib
+import json
+
+from auditlog.models import LogEntry
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import transaction
-from django.db.models import F
-from psycopg2 import IntegrityError
+from django.db import connection, transaction
+from django.http import Http404
+from django.utils import timezone
 from rest_framework import viewsets, permissions, mixins, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 import constants
 from core.cache import CacheMixin, cache_get, cache_set
-from core.models import Vendor, VendorTransaction, PhoneNumber, PhoneNumberTransaction
-from .permissions import IsVendorUser
+from core.metrics import track_transaction_amount
+from core.models import Vendor, VendorTransaction, VendorTransactionRejection, PhoneNumber, PhoneNumberTransaction
+from .permissions import IsVendorUser, get_vendor_id, stale_vendor_denied, vendor_atomic
 from .serializers import (
     VendorSerializer, VendorTransactionSerializer,
     UserUpdateSerializer,
     UserSerializer, VendorUpdateSerializer, PhoneNumberSerializer,
-    VendorTransactionUpdateSerializer, PhoneNumberTransactionSerializer
+    VendorTransactionUpdateSerializer, PhoneNumberTransactionSerializer,
+    VendorTokenObtainPairSerializer, VendorTokenRefreshSerializer
 )
 
+# blake2b accepts keys of up to 64 bytes
+TOKEN_CACHE_HASH_KEY = hashlib.sha256(settings.SECRET_KEY.encode()).digest()
+
+# Debits the vendor (only if the balance covers the amount), then credits the phone number
+# only if the debit happened and the number belongs to the vendor
+SELL_CREDIT_SQL = f"""
+    WITH debited AS (
+        UPDATE {Vendor._meta.db_table}
+        SET balance = balance - %s, total_sell = total_sell + %s
+        WHERE id = %s AND balance >= %s
+        RETURNING id
+    ), credited AS (
+        UPDATE {PhoneNumber._meta.db_table}
+        SET balance = balance + %s
+        WHERE id = %s AND vendor_id = %s AND EXISTS (SELECT 1 FROM debited)
+        RETURNING id
+    )
+    SELECT EXISTS (SELECT 1 FROM debited), EXISTS (SELECT 1 FROM credited)
+"""
+
+# Moves a pending vendor transaction to its new state and, when `credit` is set, credits its
+# amount to the vendor; returns the vendor, its user and the amount, or no row if the transaction isn't pending
+CHANGE_STATE_SQL = f"""
+    WITH changed AS (
+        UPDATE {VendorTransaction._meta.db_table}
+        SET state = %(state)s, updated_at = %(updated_at)s
+        WHERE id = %(pk)s AND state = %(pending)s
+        RETURNING vendor_id, amount
+    ), credited AS (
+        UPDATE {Vendor._meta.db_table} AS vendor
+        SET balance = vendor.balance + changed.amount
+        FROM changed
+        WHERE vendor.id = changed.vendor_id AND %(credit)s
+        RETURNING vendor.balance
+    )
+    SELECT vendor.id, COALESCE((SELECT balance FROM credited), vendor.balance), vendor.total_sell,
+           auth_user.id, auth_user.username, auth_user.email, changed.amount
+    FROM changed
+    JOIN {Vendor._meta.db_table} AS vendor ON vendor.id = changed.vendor_id
+    JOIN {User._meta.db_table} AS auth_user ON auth_user.id = vendor.user_id
+"""
+
 
 class AdminUserViewSet(CacheMixin, viewsets.ModelViewSet):
     queryset = User.objects.filter(is_staff=True)
@@ -35,7 +85,7 @@ class AdminUserViewSet(CacheMixin, viewsets.ModelViewSet):
 
 
 class VendorViewSet(CacheMixin, viewsets.ModelViewSet):
-    queryset = Vendor.objects.all()
+    queryset = Vendor.objects.select_related('user')
     permission_classes = [permissions.IsAdminUser]
 
     def get_serializer_class(self):
@@ -68,7 +118,10 @@ class VendorViewSet(CacheMixin, viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], permission_classes=[IsVendorUser])
     def me(self, request):
-        vendor = Vendor.objects.get(user=request.user)
+        try:
+            vendor = Vendor.objects.select_related('user').get(pk=get_vendor_id(request))
+        except Vendor.DoesNotExist:
+            raise stale_vendor_denied(request)
         serializer = VendorSerializer(vendor)
         return Response(serializer.data)
 
@@ -76,12 +129,14 @@ class VendorViewSet(CacheMixin, viewsets.ModelViewSet):
 class PhoneNumberViewSet(CacheMixin, viewsets.ModelViewSet):
     serializer_class = PhoneNumberSerializer
 
+    # Permissions are stateless, so the instances are built once and shared by all requests
+    read_permissions = ((permissions.IsAdminUser | IsVendorUser)(),)
+    write_permissions = (IsVendorUser(),)
+
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
-            perm_cls = permissions.IsAdminUser | IsVendorUser
-        else:
-            perm_cls = IsVendorUser
-        return [perm_cls()]
+            return self.read_permissions
+        return self.write_permissions
 
     def get_queryset(self):
         user = self.request.user
@@ -92,8 +147,8 @@ class PhoneNumberViewSet(CacheMixin, viewsets.ModelViewSet):
         return PhoneNumber.objects.filter(vendor__user=user)
 
     def perform_create(self, serializer):
-        vendor = Vendor.objects.get(user=self.request.user)
-        serializer.save(vendor=vendor)
+        with vendor_atomic(self.request) as vendor_id:
+            serializer.save(vendor_id=vendor_id)
 
 
 class VendorTransactionViewSet(
@@ -105,6 +160,7 @@ class VendorTransactionViewSet(
     viewsets.GenericViewSet
 ):
     http_method_names = ['get', 'post']
+    collection_version_field = 'updated_at'
 
     permissions_dict = {
         'list': permissions.IsAdminUser | IsVendorUser,
@@ -112,59 +168,84 @@ class VendorTransactionViewSet(
         'create': IsVendorUser,
         'change_state': permissions.IsAdminUser,
     }
+    # One shared (stateless) permission instance per action
+    permission_instances = {action: (perm(),) for action, perm in permissions_dict.items()}
 
     def get_permissions(self):
-        perm = self.permissions_dict.get(self.action)
-        return [perm()]
+        return self.permission_instances[self.action]
 
     def get_queryset(self):
         user = self.request.user
         if not user.is_authenticated:
             return VendorTransaction.objects.none()
+        # The serializer reads reject_reason from the rejection row
+        queryset = VendorTransaction.objects.select_related('rejection')
         if user.is_staff:
-            return VendorTransaction.objects.all()
-        return VendorTransaction.objects.filter(vendor__user=user)
+            return queryset
+        return queryset.filter(vendor__user=user)
 
     def get_serializer_class(self):
         if self.action == 'change_state':
             return VendorTransactionUpdateSerializer
         return VendorTransactionSerializer
 
-    @transaction.atomic
     def perform_create(self, serializer):
-        vendor = Vendor.objects.get(user=self.request.user)
-        serializer.save(vendor=vendor, state=constants.PENDING)
+        with vendor_atomic(self.request) as vendor_id:
+            serializer.save(vendor_id=vendor_id, state=constants.PENDING)
+        track_transaction_amount('vendor', constants.PENDING, serializer.instance.amount)
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
     def change_state(self, request, pk=None):
+        serializer = VendorTransactionUpdateSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        new_state = serializer.validated_data.get('state', constants.PENDING)
+
         with transaction.atomic():
-            vendor_transaction = (
-                VendorTransaction.objects
-                .select_for_update()
-                .select_related('vendor')
-                .get(pk=pk)
-            )
-            serializer = VendorTransactionUpdateSerializer(
+            with connection.cursor() as cursor:
+                cursor.execute(CHANGE_STATE_SQL, {
+                    'pk': pk,
+                    'state': new_state,
+                    'pending': constants.PENDING,
+                    'updated_at': timezone.now(),
+                    'credit': new_state == constants.APPROVED,
+                })
+                row = cursor.fetchone()
+            if row is None:
+                # Nothing changed, so there is nothing to roll back
+                if not VendorTransaction.objects.filter(pk=pk).exists():
+                    raise Http404
+                return Response({'detail': 'Transaction is not pending'}, status=status.HTTP_400_BAD_REQUEST)
+
+            vendor_id, balance, total_sell, user_id, username, email, amount = row
+            vendor = Vendor(id=vendor_id, balance=balance, total_sell=total_sell,
+                            user=User(id=user_id, username=username, email=email))
+            vendor_transaction = VendorTransaction(pk=int(pk), vendor=vendor, amount=amount, state=new_state)
+            # The UPDATEs bypass save(), so the audit log entries auditlog would write are created here
+            LogEntry.objects.log_create(
                 vendor_transaction,
-                data=request.data,
-                partial=True
+                action=LogEntry.Action.UPDATE,
+                changes=json.dumps({'state': [constants.PENDING, new_state]}),
             )
-            serializer.is_valid(raise_exception=True)
-            if vendor_transaction.state != constants.PENDING:
-                return Response({'detail': 'Transaction is not pending'}, status=status.HTTP_400_BAD_REQUEST)
-            new_state = serializer.validated_data.get('state', vendor_transaction.state)
-            vendor = Vendor.objects.select_for_update().get(pk=vendor_transaction.vendor.pk)
-            vendor_transaction.state = new_state
-            vendor_transaction.reject_reason = serializer.validated_data.get('reject_reason', '')
-            vendor_transaction.save(update_fields=['state', 'reject_reason', 'updated_at'])
             if new_state == constants.APPROVED:
-                vendor.balance = F('balance') + vendor_transaction.amount
-                vendor.save(update_fields=['balance'])
-                vendor.refresh_from_db(fields=['balance'])
-        response_data = VendorTransactionUpdateSerializer(vendor_transaction).data
-        response_data['vendor'] = VendorSerializer(vendor).data
-        self.invalidate_related_caches(vendor_transaction.vendor)
-        self.invalidate_related_caches(vendor_transaction)
+                LogEntry.objects.log_create(
+                    vendor,
+                    action=LogEntry.Action.UPDATE,
+                    changes=json.dumps({'balance': [str(balance - amount), str(balance)]}),
+                )
+            reject_reason = ''
+            if new_state == constants.REJECTED:
+                reject_reason = serializer.validated_data.get('reject_reason') or ''
+                VendorTransactionRejection.objects.create(transaction=vendor_transaction, reason=reject_reason)
+            # Registered with on_commit, so they are skipped if the transaction rolls back
+            self.invalidate_related_caches(vendor)
+            self.invalidate_related_caches(vendor_transaction)
+
+        track_transaction_amount('vendor', new_state, amount)
+        response_data = {
+            'state': new_state,
+            'reject_reason': reject_reason,
+            'vendor': VendorSerializer(vendor).data,
+        }
         return Response(response_data, status=status.HTTP_200_OK)
 
 
@@ -176,16 +257,18 @@ class PhoneNumberTransactionViewSet(
     viewsets.GenericViewSet
 ):
     http_method_names = ['get', 'post']
+    collection_version_field = 'updated_at'
     serializer_class = PhoneNumberTransactionSerializer
     permissions_dict = {
         'list': permissions.IsAdminUser | IsVendorUser,
         'retrieve': permissions.IsAdminUser | IsVendorUser,
         'create': IsVendorUser,
     }
+    # One shared (stateless) permission instance per action
+    permission_instances = {action: (perm(),) for action, perm in permissions_dict.items()}
 
     def get_permissions(self):
-        perm = self.permissions_dict.get(self.action)
-        return [perm()]
+        return self.permission_instances[self.action]
 
     def get_queryset(self):
         user = self.request.user
@@ -198,38 +281,33 @@ class PhoneNumberTransactionViewSet(
 
     @transaction.atomic
     def perform_create(self, serializer):
-        vendor = Vendor.objects.select_for_update().get(user=self.request.user)
-        phone_number = PhoneNumber.objects.select_for_update().get(
-            pk=serializer.validated_data['phone_number'].pk,
-            vendor=vendor
-        )
+        vendor_id = get_vendor_id(self.request)
+        phone_number_id = serializer.validated_data['phone_number'].pk
         amount = serializer.validated_data['amount']
 
-        try:
-            vendor.balance = F('balance') - amount
-            vendor.total_sell = F('total_sell') + amount
-            vendor.save(update_fields=['balance', 'total_sell'])
-
-            phone_number.balance = F('balance') + amount
-            phone_number.save(update_fields=['balance'])
-
-            vendor.refresh_from_db(fields=['balance', 'total_sell'])
-            phone_number.refresh_from_db(fields=['balance'])
+        # Debit the vendor and credit the phone number in one roundtrip. The balance check and
+        # the ownership check are part of the UPDATEs, so no row is locked or read beforehand
+        with connection.cursor() as cursor:
+            cursor.execute(SELL_CREDIT_SQL, [amount, amount, vendor_id, amount, amount, phone_number_id, vendor_id])
+            debited, credited = cursor.fetchone()
+        # Raising rolls back the vendor debit
+        if not debited:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["Insufficient balance."]})
+        if not credited:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["Phone number is not owned by this vendor."]})
 
-            serializer.save(
-                vendor=vendor,
-                phone_number=phone_number,
-                state=constants.APPROVED
-            )
-        except IntegrityError:
-            raise ValidationError("Insufficient balance or transaction conflict.")
-        except Exception as e:
-            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        serializer.save(vendor_id=vendor_id, state=constants.APPROVED)
+        track_transaction_amount('phone_number', constants.APPROVED, amount)
 
 
 class CachedTokenObtainPairView(TokenObtainPairView):
+    serializer_class = VendorTokenObtainPairSerializer
+
     def post(self, request, *args, **kwargs):
-        cache_key = f"jwt_token_{request.data.get('username')}"
+        # Keyed on the raw credentials body, so a hit needs neither body parsing nor a password check.
+        # The key is a keyed hash, so cache keys don't expose or allow brute-forcing the credentials.
+        digest = hashlib.blake2b(request.body, key=TOKEN_CACHE_HASH_KEY, digest_size=16).hexdigest()
+        cache_key = f"jwt_token_{digest}"
         cached_response = cache_get(cache_key)
         if cached_response:
             return Response(cached_response)
@@ -238,3 +316,7 @@ class CachedTokenObtainPairView(TokenObtainPairView):
         if response.status_code == 200:
             cache_set(cache_key, response.data, timeout=60)
         return response
+
+
+class VendorTokenRefreshView(TokenRefreshView):
+    serializer_class = VendorTokenRefreshSerializer
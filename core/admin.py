@@ -1,23 +1,41 @@
 from django.contrib import admin
 
-from core.models import Vendor, PhoneNumber, VendorTransaction, PhoneNumberTransaction
+from core.models import Vendor, PhoneNumber, VendorTransaction, VendorTransactionRejection, PhoneNumberTransaction
 
 
 @admin.register(Vendor)
 class VendorAdmin(admin.ModelAdmin):
     list_display = ['user', 'balance', 'total_sell']
+    list_select_related = ['user']
 
 
 @admin.register(PhoneNumber)
 class PhoneNumberAdmin(admin.ModelAdmin):
     list_display = ['phone_number', 'vendor', 'balance']
+    list_select_related = ['vendor__user']
+
+
+class VendorTransactionRejectionInline(admin.StackedInline):
+    model = VendorTransactionRejection
+    can_delete = False
 
 
 @admin.register(VendorTransaction)
 class VendorTransactionAdmin(admin.ModelAdmin):
-    list_display = ['vendor', 'amount', 'state', 'created_at', 'updated_at', 'reject_reason']
+    inlines = [VendorTransactionRejectionInline]
+    list_display = ['vendor_username', 'amount', 'state', 'created_at', 'updated_at', 'reject_reason']
+    list_select_related = ['vendor__user', 'rejection']
+
+    @admin.display(description='vendor', ordering='vendor__user__username')
+    def vendor_username(self, obj):
+        return obj.vendor.user.username
 
 
 @admin.register(PhoneNumberTransaction)
 class PhoneNumberTransactionAdmin(admin.ModelAdmin):
-    list_display = ['vendor', 'phone_number', 'amount', 'state', 'created_at', 'updated_at']
+    list_display = ['vendor_username', 'phone_number', 'amount', 'state', 'created_at', 'updated_at']
+    list_select_related = ['vendor__user', 'phone_number']
+
+    @admin.display(description='vendor', ordering='vendor__user__username')
+    def vendor_username(self, obj):
+        return obj.vendor.user.username
@@ -3,4 +3,12 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'core'
\ No newline at end of file
+    name = 'core'
+
+    def ready(self):
+        from django.core.signals import request_finished
+
+        from .model_metrics import MetricsModelMixin
+
+        # Model operation counts are batched per request
+        request_finished.connect(MetricsModelMixin.flush_pending, dispatch_uid='core.flush_model_operations')
@@ -1,9 +1,16 @@
 # cache.py
-from urllib.parse import urlparse
+import hashlib
+from functools import partial
 
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.http import parse_etags
+from rest_framework import status
 from rest_framework.response import Response
 
+from .metrics import track_cache_metrics
+
 
 # ──────────────
 # Helper functions
@@ -20,7 +27,9 @@ def cache_get(key: str):
     """
     Retrieve a value from the cache. Returns None if not found.
     """
-    return cache.get(key)
+    value = cache.get(key)
+    track_cache_metrics(value is not None, key)
+    return value
 
 
 def cache_delete(key: str):
@@ -30,6 +39,28 @@ def cache_delete(key: str):
     cache.delete(key)
 
 
+def _version_key(name: str) -> str:
+    return f"ver:{name}"
+
+
+def get_cache_version(name: str) -> int:
+    """
+    Return the current cache version of `name` (a viewset class name).
+    """
+    return cache.get_or_set(_version_key(name), 1, timeout=None)
+
+
+def bump_cache_version(name: str):
+    """
+    Move `name` to a new cache version, orphaning every key built with the old one.
+    """
+    try:
+        cache.incr(_version_key(name))
+    except ValueError:
+        # No version stored yet (or it was evicted); anything cached was keyed with the default 1
+        cache.set(_version_key(name), 2, timeout=None)
+
+
 # ──────────────
 # DRF Mixin
 # ──────────────
@@ -40,12 +71,31 @@ class CacheMixin:
       • Caches GET-list and GET-detail
       • Invalidates cache on create/update/partial_update/destroy
       • Provides manual invalidation methods
+      • Answers GET-list with ETag / 304 Not Modified instead when
+        `collection_version_field` is set
     """
 
     # default cache timeout (seconds); override per-view if needed
     cache_timeout: int = 300
 
+    # timestamp field (e.g. `updated_at`) whose MAX() versions the list; None keeps the cached list body
+    collection_version_field: str = None
+
+    # Key prefixes derived from the viewset class name, set once per class in __init_subclass__
+    _cache_name: str = None
+    _list_key_prefix: str = None
+    _detail_key_prefix: str = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._cache_name = cls.__name__
+        cls._list_key_prefix = f"{cls.__name__}:list:v"
+        cls._detail_key_prefix = f"{cls.__name__}:detail:v"
+
     def list(self, request, *args, **kwargs):
+        if self.collection_version_field is not None:
+            return self._conditional_list(request, *args, **kwargs)
+
         key = self._list_cache_key(request)
         data = cache_get(key)
         if data is None:
@@ -55,6 +105,30 @@ class CacheMixin:
             return response
         return Response(data)
 
+    def _conditional_list(self, request, *args, **kwargs):
+        etag = self._list_etag(request)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+    def get_collection_version(self):
+        """
+        Version of the rows the list shows: the latest `collection_version_field`
+        value plus the row count, so both writes and deletes change it.
+        """
+        return self.get_queryset().aggregate(
+            version=Max(self.collection_version_field),
+            count=Count('pk'),
+        )
+
+    def _list_etag(self, request) -> str:
+        version = self.get_collection_version()
+        raw = f"{request.get_full_path()}:{request.user.pk}:{version['version']}:{version['count']}"
+        return '"%s"' % hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
     def retrieve(self, request, *args, **kwargs):
         pk = kwargs.get(self.lookup_field, kwargs.get('pk'))
         key = self._detail_cache_key(request, pk)
@@ -68,43 +142,27 @@ class CacheMixin:
 
     def create(self, request, *args, **kwargs):
         response = super().create(request, *args, **kwargs)
-        # clear list cache so new item will appear
-        if response.status_code in (200, 201):
-            cache_delete(self._list_cache_key(request))
+        # clear list cache so new item will appear; ETag-versioned lists are never cached,
+        # and a new row can't stale any cached detail, so those creates skip the cache entirely
+        if response.status_code in (200, 201) and self.collection_version_field is None:
+            self._invalidate_all_list_caches(request)
         return response
 
     def _invalidate_all_list_caches(self, request):
         """
-        Invalidate all possible list cache variations by using a pattern.
-        This is needed because list caches might have different query parameters.
+        Invalidate every cached list and detail of this viewset, whatever its query
+        params or user, by bumping the version baked into their keys.
+        The orphaned entries expire through their timeout.
+        Inside a transaction the bump waits for the commit and is dropped on rollback.
         """
-        # Get base cache key without query params
-        parsed = urlparse(request.path)
-        path_parts = parsed.path.rstrip('/').split('/')
-        base_path = '/'.join(path_parts[:-1]) + '/' if len(path_parts) > 1 else '/'
-        base_key = f"{self.__class__.__name__}:list:{base_path}"
-        # If using redis, we can delete all keys matching the pattern
-        if hasattr(cache, 'keys'):
-            try:
-                # Get all keys matching the base pattern
-                keys = cache.keys(f"{base_key}*")
-                if keys:
-                    cache.delete_many(keys)
-                return
-            except (AttributeError, NotImplementedError):
-                pass
-
-        # Fallback: delete the exact key (with current query params)
-        cache_delete(self._list_cache_key(request))
+        transaction.on_commit(partial(bump_cache_version, self._cache_name))
 
     def update(self, request, *args, **kwargs):
-        pk = kwargs.get(self.lookup_field, kwargs.get('pk'))
         # Get instance before update for any cleanup if needed
         instance = self.get_object()
         response = super().update(request, *args, **kwargs)
         # clear both detail and all list caches
         if response.status_code == 200:
-            cache_delete(self._detail_cache_key(request, pk))
             self._invalidate_all_list_caches(request)
 
             # If there are any related caches, invalidate them too
@@ -120,11 +178,9 @@ class CacheMixin:
     def destroy(self, request, *args, **kwargs):
         # Get instance before deletion for cleanup
         instance = self.get_object()
-        pk = kwargs.get(self.lookup_field, kwargs.get('pk'))
         response = super().destroy(request, *args, **kwargs)
         # clear caches if delete succeeded
         if response.status_code == 204:
-            cache_delete(self._detail_cache_key(request, pk))
             self._invalidate_all_list_caches(request)
 
             # If there are any related caches, invalidate them too
@@ -146,31 +202,25 @@ class CacheMixin:
         cache_delete(self._detail_cache_key(request, pk))
 
     def invalidate_related_caches(self, instance):
-        for cache_key in self._get_instance_related_caches(instance):
-            # If using redis, we can delete all keys matching the pattern
-            if hasattr(cache, 'keys'):
-                try:
-                    # Get all keys matching the base pattern
-                    keys = cache.keys(cache_key)
-                    if keys:
-                        cache.delete_many(keys)
-                except (AttributeError, NotImplementedError):
-                    pass
+        """Invalidate the caches of the viewset serving `instance`, once the current transaction commits."""
+        transaction.on_commit(partial(bump_cache_version, self._get_instance_viewset_name(instance)))
 
     # ──────────────
     # Cache-key builders
     # ──────────────
 
     def _list_cache_key(self, request) -> str:
-        # include path to namespace list caches
-        return f"{self.__class__.__name__}:list:{request.get_full_path()}"
+        # include the version and path to namespace list caches, and the user since querysets are filtered per user
+        return (f"{self._list_key_prefix}{get_cache_version(self._cache_name)}:"
+                f"{request.get_full_path()}:u{request.user.pk}")
 
     def _detail_cache_key(self, request, pk) -> str:
-        # include pk and path to namespace per-object caches
-        return f"{self.__class__.__name__}:detail:{pk}:{request.get_full_path()}"
+        # include the version, pk and path to namespace per-object caches, and the user as for lists
+        return (f"{self._detail_key_prefix}{get_cache_version(self._cache_name)}:{pk}:"
+                f"{request.get_full_path()}:u{request.user.pk}")
 
     @staticmethod
-    def _get_instance_related_caches(instance):
+    def _get_instance_viewset_name(instance):
         class_names = {
             'User': 'AdminUserViewSet',
             'Vendor': 'VendorViewSet',
@@ -178,5 +228,4 @@ class CacheMixin:
             'VendorTransaction': 'VendorTransactionViewSet',
             'PhoneNumberTransaction': 'PhoneNumberTransactionViewSet',
         }
-        base_key = f"{class_names[instance.__class__.__name__]}"
-        return f"*{base_key}:list:*", f"*{base_key}:detail:{instance.pk}:*"
+        return class_names[instance.__class__.__name__]
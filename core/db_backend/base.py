@@ -0,0 +1,13 @@
+from django_prometheus.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend (with django-prometheus instrumentation) that never logs queries just because DEBUG is on.
+    Django's debug cursor appends every query to `connection.queries`; here that only happens
+    when `force_debug_cursor` is set, e.g. by assertNumQueries or CaptureQueriesContext.
+    """
+
+    @property
+    def queries_logged(self):
+        return self.force_debug_cursor
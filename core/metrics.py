@@ -1,11 +1,151 @@
+import itertools
+import os
+import threading
 import time
-from functools import wraps
+from functools import lru_cache
 
+from django.apps import apps
+from django.core.cache import cache
 from django.db import connection
-from prometheus_client import Counter, Histogram, Gauge
+from django.db.models import Count, Q, Sum
+from django.urls import Resolver404, resolve
+from prometheus_client import REGISTRY, Counter, Histogram, Gauge
+from prometheus_client.core import CounterMetricFamily, GaugeHistogramMetricFamily
+
+import constants
+
+# Monotonic clock for durations, bound once; durations are measured in integer nanoseconds
+_now_ns = time.perf_counter_ns
+
+
+class StripedCounter:
+    """
+    Labelled counter spread over independently locked shards, so concurrent increments
+    from different threads rarely wait on the same lock. Each thread is assigned a shard
+    on first use; the shards are summed when Prometheus scrapes the registry.
+    Not aggregated by prometheus_client's multiprocess mode.
+    """
+
+    def __init__(self, name, documentation, labelnames, shards=None, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Rounded up to a power of two so a shard is picked with a mask
+        shards = shards or os.cpu_count() or 1
+        shards = 1 << (shards - 1).bit_length()
+        self._mask = shards - 1
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self, labelvalues, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = next(self._next_shard) & self._mask
+        values, lock = self._shards[shard]
+        key = tuple(str(value) for value in labelvalues)
+        with lock:
+            values[key] = values.get(key, 0) + amount
+
+    def describe(self):
+        return [CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)]
+
+    def collect(self):
+        totals = {}
+        for values, lock in self._shards:
+            with lock:
+                items = list(values.items())
+            for key, value in items:
+                totals[key] = totals.get(key, 0) + value
+        family = CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for key, value in totals.items():
+            family.add_metric(key, value)
+        yield family
+
+
+class VendorBalanceSnapshot:
+    """
+    Gauge histogram of current vendor balances, so balance changes cost nothing on the
+    transaction path. The bucket counts come from one aggregate query and are shared by all
+    workers through the Django cache for `refresh_interval` seconds.
+    Scrapes only read the last snapshot: a stale one is re-queried on a background thread,
+    never on the scrape itself, which may be running on an event loop (see Tabdil.asgi).
+    """
+
+    def __init__(self, name, documentation, buckets, refresh_interval=15, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.refresh_interval = refresh_interval
+        self.cache_key = f"metrics:{name}"
+        self._snapshot = None
+        self._next_refresh = 0
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def query(self):
+        """
+        Read the bucket counts and balance sum from the vendor table.
+        """
+        aggregates = {f'le_{i}': Count('pk', filter=Q(balance__lte=bound)) for i, bound in enumerate(self.buckets)}
+        try:
+            result = apps.get_model('core', 'Vendor').objects.aggregate(
+                total=Count('pk'), sum=Sum('balance'), **aggregates
+            )
+        finally:
+            # The refresh thread owns this connection; don't leave it open behind
+            connection.close()
+        buckets = [(str(float(bound)), result[f'le_{i}']) for i, bound in enumerate(self.buckets)]
+        buckets.append(('+Inf', result['total']))
+        return buckets, result['sum'] or 0
+
+    def refresh(self):
+        """
+        Query a fresh snapshot and share it through the cache; failures keep the previous one.
+        """
+        try:
+            snapshot = self.query()
+            self._snapshot = snapshot
+            cache.set(self.cache_key, snapshot, self.refresh_interval)
+        except Exception:
+            pass
+
+    def schedule_refresh(self):
+        """
+        Start a background refresh, at most once per `refresh_interval` in this process.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_refresh:
+                return
+            self._next_refresh = now + self.refresh_interval
+        threading.Thread(target=self.refresh, name=f'{self.name}-refresh', daemon=True).start()
+
+    def describe(self):
+        return [GaugeHistogramMetricFamily(self.name, self.documentation)]
+
+    def collect(self):
+        # A failing gauge must not break the whole scrape
+        try:
+            snapshot = cache.get(self.cache_key)
+            if snapshot is None:
+                self.schedule_refresh()
+                snapshot = self._snapshot
+            else:
+                self._snapshot = snapshot
+        except Exception:
+            snapshot = self._snapshot
+        if snapshot is not None:
+            buckets, gsum = snapshot
+            yield GaugeHistogramMetricFamily(self.name, self.documentation, buckets=buckets, gsum_value=gsum)
+
 
 # Define metrics
-API_REQUESTS_TOTAL = Counter(
+API_REQUESTS_TOTAL = StripedCounter(
     'api_requests_total',
     'Total count of API requests',
     ['method', 'endpoint', 'status']
@@ -14,10 +154,25 @@ API_REQUESTS_TOTAL = Counter(
 API_REQUEST_DURATION = Histogram(
     'api_request_duration_seconds',
     'Histogram of API request durations',
-    ['method', 'endpoint'],
+    # No endpoint label: buckets x endpoints explodes the series count; per-endpoint counts live on API_REQUESTS_TOTAL
+    ['method'],
     buckets=[0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0]
 )
 
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request',
+    'Histogram of database queries per request',
+    ['endpoint'],
+    buckets=[0, 1, 2, 5, 10, 15, 20, 25, 30, 40, 50, 75, 100]
+)
+
+DB_QUERY_DURATION_PER_REQUEST = Histogram(
+    'db_query_duration_per_request_seconds',
+    'Histogram of total database query duration per request',
+    ['endpoint'],
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0]
+)
+
 DB_QUERY_DURATION = Histogram(
     'db_query_duration_seconds',
     'Histogram of database query durations',
@@ -25,16 +180,16 @@ DB_QUERY_DURATION = Histogram(
     buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0]
 )
 
-CACHE_HITS = Counter(
+CACHE_HITS = StripedCounter(
     'cache_hits_total',
     'Total count of cache hits',
-    ['cache_key']
+    ['cache_bucket']
 )
 
-CACHE_MISSES = Counter(
+CACHE_MISSES = StripedCounter(
     'cache_misses_total',
     'Total count of cache misses',
-    ['cache_key']
+    ['cache_bucket']
 )
 
 ACTIVE_USERS = Gauge(
@@ -43,10 +198,11 @@ ACTIVE_USERS = Gauge(
     ['user_type']
 )
 
-VENDOR_BALANCE = Gauge(
-    'vendor_balance',
-    'Current balance of vendors',
-    ['vendor_id']
+# Balances as they are updated; no per-vendor label, which would add a series per vendor
+VENDOR_BALANCE_DIST = VendorBalanceSnapshot(
+    'vendor_balance_dist',
+    'Distribution of current vendor balances',
+    buckets=[0, 100, 1000, 10000, 100000, 1000000, 10000000]
 )
 
 TRANSACTION_AMOUNT = Counter(
@@ -55,75 +211,160 @@ TRANSACTION_AMOUNT = Counter(
     ['transaction_type', 'state']
 )
 
+# Fixed label sets: their children are created once here instead of per call
+TRANSACTION_TYPES = ('vendor', 'phone_number')
+TRANSACTION_STATES = tuple(state for state, _ in constants.TRANSACTION_STATE)
+USER_TYPES = ('admin', 'vendor')
+
+# Any other transaction type or state is counted as OTHER_LABEL, so those labels stay bounded
+OTHER_LABEL = 'other'
+_ALLOWED_TRANSACTION_TYPES = frozenset(TRANSACTION_TYPES)
+_ALLOWED_TRANSACTION_STATES = frozenset(TRANSACTION_STATES)
+
+_TRANSACTION_AMOUNT_CHILDREN = {
+    (transaction_type, state): TRANSACTION_AMOUNT.labels(transaction_type=transaction_type, state=state)
+    for transaction_type in TRANSACTION_TYPES + (OTHER_LABEL,)
+    for state in TRANSACTION_STATES + (OTHER_LABEL,)
+}
+_ACTIVE_USERS_CHILDREN = {user_type: ACTIVE_USERS.labels(user_type=user_type) for user_type in USER_TYPES}
+_DB_QUERY_DURATION_ALL = DB_QUERY_DURATION.labels(query_type='all')
+
 
-def track_request_metrics(view_func):
+# Label children are memoized so the hot path skips the labels() lookup and its lock
+@lru_cache(maxsize=64)
+def _api_request_duration(method):
+    return API_REQUEST_DURATION.labels(method=method)
+
+
+@lru_cache(maxsize=1024)
+def _db_queries_per_request(endpoint):
+    return DB_QUERIES_PER_REQUEST.labels(endpoint=endpoint)
+
+
+@lru_cache(maxsize=1024)
+def _db_query_duration_per_request(endpoint):
+    return DB_QUERY_DURATION_PER_REQUEST.labels(endpoint=endpoint)
+
+
+def _endpoint_label(request):
+    """
+    Label requests by URL pattern name rather than path, so ids in URLs
+    don't create a new time series each.
     """
-    Decorator to track API request metrics.
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'unknown'
+    return match.view_name or match.route or 'unknown'
+
+
+def record_request_metrics(request, status, duration, db_metrics):
     """
-    @wraps(view_func)
-    def wrapper(request, *args, **kwargs):
-        method = request.method
-        endpoint = request.path
-        
-        start_time = time.time()
-        response = view_func(request, *args, **kwargs)
-        duration = time.time() - start_time
-        
-        status = response.status_code
-        API_REQUESTS_TOTAL.labels(method=method, endpoint=endpoint, status=status).inc()
-        API_REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(duration)
-        
-        return response
-    return wrapper
+    Record one finished request and the queries it ran (a track_db_metrics() tracker);
+    called by core.middleware.MetricsMiddleware once the response is ready.
+    """
+    endpoint = _endpoint_label(request)
+    API_REQUESTS_TOTAL.inc((request.method, endpoint, status))
+    _api_request_duration(request.method).observe(duration)
+    if db_metrics.query_count:
+        _db_queries_per_request(endpoint).observe(db_metrics.query_count)
+        _db_query_duration_per_request(endpoint).observe(db_metrics.query_time_ns * 1e-9)
 
 
 def track_db_metrics():
     """
     Context manager to track database query metrics.
+    Each query is timed by a connection execute wrapper, so this doesn't depend on
+    the DEBUG-only `connection.queries`.
     """
     class DBMetricsTracker:
         def __enter__(self):
-            self.start_time = time.time()
-            self.initial_queries = len(connection.queries)
+            self.query_count = 0
+            self.query_time_ns = 0
+            self._histogram = _DB_QUERY_DURATION_ALL
+            self._wrapper = connection.execute_wrapper(self._count_query)
+            self._wrapper.__enter__()
             return self
-            
+
+        def _count_query(self, execute, sql, params, many, context):
+            start_ns = _now_ns()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                elapsed_ns = _now_ns() - start_ns
+                self.query_count += 1
+                self.query_time_ns += elapsed_ns
+                self._histogram.observe(elapsed_ns * 1e-9)
+
         def __exit__(self, exc_type, exc_val, exc_tb):
-            duration = time.time() - self.start_time
-            num_queries = len(connection.queries) - self.initial_queries
-            
-            if num_queries > 0:
-                avg_duration = duration / num_queries
-                DB_QUERY_DURATION.labels(query_type='all').observe(avg_duration)
-    
+            self._wrapper.__exit__(exc_type, exc_val, exc_tb)
+
     return DBMetricsTracker()
 
 
-def update_vendor_balance_metric(vendor_id, balance):
+def track_transaction_amount(transaction_type, state, amount):
     """
-    Update the vendor balance metric.
+    Track transaction amount.
+    Unknown transaction types and states are counted under 'other'.
     """
-    VENDOR_BALANCE.labels(vendor_id=str(vendor_id)).set(balance)
+    if transaction_type not in _ALLOWED_TRANSACTION_TYPES:
+        transaction_type = OTHER_LABEL
+    if state not in _ALLOWED_TRANSACTION_STATES:
+        state = OTHER_LABEL
+    _TRANSACTION_AMOUNT_CHILDREN[(transaction_type, state)].inc(amount)
 
 
-def track_transaction_amount(transaction_type, state, amount):
+# Cache hits/misses of the current request, flushed once per request by core.middleware.MetricsMiddleware
+_cache_local = threading.local()
+
+
+def _cache_bucket(cache_key):
     """
-    Track transaction amount.
+    Bounded label for a cache key: its prefix before the first ':' (the viewset name for CacheMixin keys).
     """
-    TRANSACTION_AMOUNT.labels(transaction_type=transaction_type, state=state).inc(amount)
+    bucket, sep, _ = cache_key.partition(':')
+    return bucket if sep else 'other'
 
 
 def track_cache_metrics(hit, cache_key):
     """
     Track cache hit/miss metrics.
+    Only counts in a per-request dict; the counters are updated by flush_cache_metrics().
+    """
+    try:
+        counts = _cache_local.counts
+    except AttributeError:
+        counts = _cache_local.counts = {}
+    key = (hit, _cache_bucket(cache_key))
+    counts[key] = counts.get(key, 0) + 1
+
+
+def reset_cache_metrics():
+    """
+    Start counting cache hits/misses for a new request.
+    """
+    _cache_local.counts = {}
+
+
+def flush_cache_metrics():
+    """
+    Add the cache hits/misses counted for the current request to the counters.
     """
-    if hit:
-        CACHE_HITS.labels(cache_key=cache_key).inc()
-    else:
-        CACHE_MISSES.labels(cache_key=cache_key).inc()
+    counts = getattr(_cache_local, 'counts', None)
+    if not counts:
+        return
+    for (hit, bucket), count in counts.items():
+        (CACHE_HITS if hit else CACHE_MISSES).inc((bucket,), count)
+    counts.clear()
 
 
 def update_active_users(user_type, count):
     """
     Update the active users metric.
     """
-    ACTIVE_USERS.labels(user_type=user_type).set(count)
\ No newline at end of file
+    child = _ACTIVE_USERS_CHILDREN.get(user_type)
+    if child is None:
+        child = ACTIVE_USERS.labels(user_type=user_type)
+    child.set(count)
@@ -0,0 +1,32 @@
+import time
+
+from api.utils import is_untracked_path
+from .metrics import flush_cache_metrics, record_request_metrics, reset_cache_metrics, track_db_metrics
+
+
+class MetricsMiddleware:
+    """
+    Middleware to collect the core.metrics request and database metrics for each request,
+    and to scope the per-request cache hit/miss counts.
+    Database queries are counted and timed with a connection execute wrapper,
+    so the metrics don't depend on DEBUG-only `connection.queries`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._time_ns = time.perf_counter_ns
+
+    def __call__(self, request):
+        # Don't measure Prometheus scrapes and static files
+        if is_untracked_path(request.path):
+            return self.get_response(request)
+
+        reset_cache_metrics()
+        start_ns = self._time_ns()
+        try:
+            with track_db_metrics() as db_metrics:
+                response = self.get_response(request)
+        finally:
+            flush_cache_metrics()
+        record_request_metrics(request, response.status_code, (self._time_ns() - start_ns) * 1e-9, db_metrics)
+        return response
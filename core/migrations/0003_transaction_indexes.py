@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-15 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_alter_phonenumber_vendor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='phonenumbertransaction',
+            index=models.Index(fields=['state', 'created_at'], name='core_phonen_state_3bb803_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='phonenumbertransaction',
+            index=models.Index(fields=['vendor', 'created_at'], name='core_phonen_vendor__727666_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='phonenumbertransaction',
+            index=models.Index(fields=['phone_number', 'created_at'], name='core_phonen_phone_n_a2e765_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vendortransaction',
+            index=models.Index(fields=['state', 'created_at'], name='core_vendor_state_ed962b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vendortransaction',
+            index=models.Index(fields=['vendor', 'created_at'], name='core_vendor_vendor__58448c_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-15 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vendor',
+            name='total_sell',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
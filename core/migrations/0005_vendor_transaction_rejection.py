@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-15 20:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def move_reject_reasons(apps, schema_editor):
+    VendorTransaction = apps.get_model('core', 'VendorTransaction')
+    VendorTransactionRejection = apps.get_model('core', 'VendorTransactionRejection')
+    # Every rejected transaction gets a row, even without a reason; so does any other one with a reason
+    rejected = VendorTransaction.objects.filter(
+        Q(state='Rejected') | (Q(reject_reason__isnull=False) & ~Q(reject_reason=''))
+    )
+    VendorTransactionRejection.objects.bulk_create(
+        (VendorTransactionRejection(transaction_id=pk, reason=reason or '')
+         for pk, reason in rejected.values_list('pk', 'reject_reason').iterator()),
+        batch_size=1000,
+    )
+
+
+def restore_reject_reasons(apps, schema_editor):
+    VendorTransaction = apps.get_model('core', 'VendorTransaction')
+    VendorTransactionRejection = apps.get_model('core', 'VendorTransactionRejection')
+    for transaction_id, reason in VendorTransactionRejection.objects.values_list('transaction_id', 'reason').iterator():
+        VendorTransaction.objects.filter(pk=transaction_id).update(reject_reason=reason)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_vendor_total_sell_bigint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorTransactionRejection',
+            fields=[
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rejection', serialize=False, to='core.vendortransaction')),
+                ('reason', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(move_reject_reasons, restore_reject_reasons),
+        migrations.RemoveField(
+            model_name='vendortransaction',
+            name='reject_reason',
+        ),
+    ]
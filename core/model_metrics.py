@@ -1,3 +1,5 @@
+import threading
+
 from prometheus_client import Counter
 
 # Define metrics
@@ -8,15 +10,50 @@ MODEL_OPERATIONS = Counter(
 )
 
 
+# Operations whose counter children are created per model class up front
+KNOWN_OPERATIONS = ('create', 'update', 'delete')
+
+
 class MetricsModelMixin:
     """
     Mixin to add metrics tracking to models.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._operation_children = {
+            operation: MODEL_OPERATIONS.labels(model=cls.__name__, operation=operation)
+            for operation in KNOWN_OPERATIONS
+        }
+
+    # Operation counts of the current thread, added to MODEL_OPERATIONS by flush_pending()
+    _pending = threading.local()
+
     @classmethod
     def track_operation(cls, operation):
         """
         Track a model operation.
+        Only counted locally; flushed when the request finishes.
+        """
+        try:
+            counts = MetricsModelMixin._pending.counts
+        except AttributeError:
+            counts = MetricsModelMixin._pending.counts = {}
+        key = (cls, operation)
+        counts[key] = counts.get(key, 0) + 1
+
+    @staticmethod
+    def flush_pending(**kwargs):
+        """
+        Add this thread's pending operation counts to MODEL_OPERATIONS.
+        Connected to `request_finished` in CoreConfig.ready().
         """
-        model_name = cls.__name__
-        MODEL_OPERATIONS.labels(model=model_name, operation=operation).inc()
+        counts = getattr(MetricsModelMixin._pending, 'counts', None)
+        if not counts:
+            return
+        for (model, operation), count in counts.items():
+            child = model._operation_children.get(operation)
+            if child is None:
+                child = MODEL_OPERATIONS.labels(model=model.__name__, operation=operation)
+            child.inc(count)
+        counts.clear()
@@ -23,9 +23,11 @@ class Vendor(MetricsModelMixin, models.Model):
     Vendor has access to CRUD Phone Numbers also, vendor has balance and can charge Phone Numbers.
     Total sell is the total number of credits sold to phone numbers by vendor
     """
+    # OneToOne gives user_id a UNIQUE btree index, so lookups by user are a single index probe
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     balance = models.PositiveIntegerField(default=0)
-    total_sell = models.PositiveIntegerField(default=0)
+    # Running sum of every sale; 64-bit so it cannot overflow where per-row amounts stay 32-bit
+    total_sell = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
@@ -80,20 +82,58 @@ class BaseTransaction(TimeStampMixin):
 class VendorTransaction(MetricsModelMixin, BaseTransaction):
     """
     Transactions related to vendor.
+    __str__ only uses local columns; use .select_related('vendor__user') when iterating over vendor details.
     """
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='vendor_transactions')
-    reject_reason = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'created_at']),
+            models.Index(fields=['vendor', 'created_at']),
+        ]
 
     def __str__(self):
-        return f"[Vendor Transaction] {self.vendor.user.username} - {self.amount} - {self.state}"
+        return f"[Vendor Transaction] {self.vendor_id} - {self.amount} - {self.state}"
+
+    @property
+    def reject_reason(self):
+        """
+        Reason stored on the VendorTransactionRejection row, '' if there is none.
+        Use .select_related('rejection') when reading it for many transactions.
+        """
+        try:
+            return self.rejection.reason
+        except VendorTransactionRejection.DoesNotExist:
+            return ''
+
+
+class VendorTransactionRejection(models.Model):
+    """
+    Reject reason of a vendor transaction.
+    Kept in its own table because few transactions are rejected, so the transactions table stays narrow.
+    """
+    transaction = models.OneToOneField(VendorTransaction, on_delete=models.CASCADE, primary_key=True,
+                                       related_name='rejection')
+    reason = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"[Vendor Transaction Rejection] {self.transaction_id}"
 
 
 class PhoneNumberTransaction(MetricsModelMixin, BaseTransaction):
     """
     Transactions related to phone number.
+    __str__ only uses local columns; use .select_related('phone_number') when iterating over phone numbers.
     """
     phone_number = models.ForeignKey(PhoneNumber, on_delete=models.CASCADE, related_name='phone_number_transactions')
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='phone_transactions')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'created_at']),
+            models.Index(fields=['vendor', 'created_at']),
+            models.Index(fields=['phone_number', 'created_at']),
+        ]
+
     def __str__(self):
-        return f"[PhoneNumber Transaction] {self.phone_number.phone_number} - {self.amount} - {self.state}"
+        return f"[PhoneNumber Transaction] {self.phone_number_id} - {self.amount} - {self.state}"